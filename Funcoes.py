@@ -2,7 +2,9 @@ from qampy import signals, impairments, equalisation, phaserec, helpers
 from qampy.theory import ber_vs_es_over_n0_qam as ber_theory
 from qampy.helpers import normalise_and_center as normcenter
 from qampy.core.filter import rrcos_pulseshaping as lowpassFilter
+from functools import lru_cache
 import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
 import matplotlib.pyplot as plt
 from tensorflow.keras.layers import Dense, Dropout
 from tensorflow.keras.models import Sequential
@@ -32,6 +34,24 @@ def generate_signal(M: int, Fb: int, SpS: int, SNR: float, rolloff=0.01):
 
     return QAM_signal
 
+@lru_cache(maxsize=2)
+def _phasor(N: int, fs: float, fb: float):
+    """Fasor exp(1j*2*pi*(fb/2)*t) usado no deslocamento em frequência do sinal
+    em fase mínima. Apenas os últimos fasores usados ficam em cache, já que cada um
+    ocupa N amostras complex128.
+
+    Args:
+        N (int): Número de amostras do sinal.
+        fs (float): Frequência de amostragem.
+        fb (float): Taxa de símbolos.
+
+    Returns:
+        phasor (np.ndarray): Vetor complexo com N amostras.
+    """
+    phasor = np.exp(1j*np.pi*fb/fs*np.arange(N, dtype=np.float64))
+    phasor.flags.writeable = False
+    return phasor
+
 def qam_signal_phase_min(signal,A=None):
     """Criação do sinal QAM em fase mínima.
 
@@ -47,11 +67,9 @@ def qam_signal_phase_min(signal,A=None):
         A (float): 
     """
     sfm = signal.copy()
-    t = np.arange(0, sfm[0].size)*1/sfm.fs
     if A is None:
       A = (np.max(np.abs(sfm)))
-    Δf = 2*np.pi*(sfm.fb/2)*t
-    sfm = A + sfm*np.exp(1j*Δf)
+    sfm = A + sfm*_phasor(sfm[0].size, sfm.fs, sfm.fb)
     CSPR = (A**2/2)/np.mean(np.abs(signal**2))
     return sfm , A , 10*np.log10(CSPR)
 
@@ -66,12 +84,34 @@ def abs_and_phases(sfm):
         data (dict): Dicionário com os arrays contendo as informações de
         amplitudes e fases do sinal.
     """
-    amplitudes = np.abs(sfm.copy()[0])
-    phases = np.angle(sfm.copy()[0])
+    z = sfm[0]
+    amplitudes = np.empty_like(z, dtype=np.float32)
+    phases = np.empty_like(z, dtype=np.float32)
+    np.hypot(z.real, z.imag, out=amplitudes)
+    np.arctan2(z.imag, z.real, out=phases)
     data = {'amplitudes': amplitudes, 'phases': phases}
     return data
 
-def dataset_01(sfm, ordem: int):
+def _features(amplitudes, size: int, ordem: int):
+    """Janelas deslizantes de tamanho `ordem` sobre o vetor de amplitudes, sem cópia.
+
+    Args:
+        amplitudes (np.ndarray): Vetor de amplitudes do sinal.
+        size (int): Número de janelas (linhas de X).
+        ordem (int): Tamanho de cada janela.
+
+    Returns:
+        X (np.ndarray): View (size, ordem) somente leitura sobre `amplitudes`.
+
+    Raises:
+        ValueError: Se `amplitudes` tiver menos que size+ordem-1 amostras.
+    """
+    if amplitudes.size < size + ordem - 1:
+        raise ValueError(f'São necessárias {size + ordem - 1} amostras de amplitude para '
+                         f'{size} janelas de tamanho {ordem}, mas o sinal tem {amplitudes.size}.')
+    return sliding_window_view(amplitudes, ordem)[:size]
+
+def dataset_01(sfm, ordem: int, data=None):
     """O dataset criado pela função é o resultado de uma convolução simples ao longo
     do vetor das amplitudes, para a criação das features, e a fase correspondente à
     ultima amostra de amplitude em cada passo da convolução.
@@ -80,6 +120,8 @@ def dataset_01(sfm, ordem: int):
         sfm (ResampledQAM: np.ndarray): Símbolos do sinal QAM a ser observado.
         ordem (int): Número de amostras de amplitudes a serem observadas para a análise
             de uma amostra de fase.
+        data (dict, optional): Saída de abs_and_phases(sfm) já calculada, para reaproveitá-la
+            entre os datasets de um mesmo sinal. Não é modificada. Defaults to None.
 
     Returns:
         data (dict[np.ndarray, np.ndarray]): Dicionário com os arrays contendo as informações de
@@ -90,20 +132,19 @@ def dataset_01(sfm, ordem: int):
             forma que qualquer algorítmo de regressão de ML pode utilizar como features.
     """
     size = 60000
-    data = abs_and_phases(sfm)
-    amplitudes = data['amplitudes'].copy()
-    phases = data['phases'].copy()
-    X = np.zeros((size, ordem))
-    for n in range(size):
-        aux = amplitudes[n:ordem+n]
-        X[n] = aux
+    if data is None:
+        data = abs_and_phases(sfm)
+    data = dict(data)
+    amplitudes = data['amplitudes']
+    phases = data['phases']
+    X = _features(amplitudes, size, ordem)
     y = phases[ordem-1:size+ordem-1]
     data['amplitudes'] = data['amplitudes'][ordem-1:size+ordem-1]
     data['phases'] = data['phases'][ordem-1:size+ordem-1]
 
     return data, X, y.reshape(-1,)
 
-def dataset_02(sfm, ordem: int,size):
+def dataset_02(sfm, ordem: int,size, data=None):
     """O dataset criado pela função é o resultado de uma convolução simples ao longo
     do vetor das amplitudes, para a criação das features, e a fase correspondente à
     amostra de amplitude central da janela em cada passo da convolução.
@@ -112,6 +153,8 @@ def dataset_02(sfm, ordem: int,size):
         sfm (ResampledQAM: np.ndarray): Símbolos do sinal QAM a ser observado.
         ordem (int): Número de amostras de amplitudes a serem observadas para a análise
             de uma amostra de fase.
+        data (dict, optional): Saída de abs_and_phases(sfm) já calculada, para reaproveitá-la
+            entre os datasets de um mesmo sinal. Não é modificada. Defaults to None.
 
     Returns:
         data (dict[np.ndarray, np.ndarray]): Dicionário com os arrays contendo as informações de
@@ -121,20 +164,19 @@ def dataset_02(sfm, ordem: int,size):
         y (np.ndarray): Vetor coluna contendo as informações de fases do sinal dispostas de tal 
             forma que qualquer algorítmo de regressão de ML pode utilizar como features.
     """
-    data = abs_and_phases(sfm)
-    amplitudes = data['amplitudes'].copy()
-    phases = data['phases'].copy()
-    X = np.zeros((size, ordem))
-    for n in range(size):
-        aux = amplitudes[n:ordem+n]
-        X[n] = aux
+    if data is None:
+        data = abs_and_phases(sfm)
+    data = dict(data)
+    amplitudes = data['amplitudes']
+    phases = data['phases']
+    X = _features(amplitudes, size, ordem)
     y = phases[int(ordem/2):size+int(ordem/2)]
     data['amplitudes'] = data['amplitudes'][int(ordem/2):size+int(ordem/2)]
     data['phases'] = data['phases'][int(ordem/2):size+int(ordem/2)]
 
     return data, X, y
 
-def dataset_03(sfm, ordem: int):
+def dataset_03(sfm, ordem: int, data=None):
     """O dataset criado pela função é o resultado de uma convolução simples ao longo
     do vetor das amplitudes, para a criação das features, e a fase correspondente à
     primeira amostra de amplitude em cada passo da convolução.
@@ -143,6 +185,8 @@ def dataset_03(sfm, ordem: int):
         sfm (ResampledQAM: np.ndarray): Símbolos do sinal QAM a ser observado.
         ordem (int): Número de amostras de amplitudes a serem observadas para a análise
             de uma amostra de fase.
+        data (dict, optional): Saída de abs_and_phases(sfm) já calculada, para reaproveitá-la
+            entre os datasets de um mesmo sinal. Não é modificada. Defaults to None.
 
     Returns:
         data (dict[np.ndarray, np.ndarray]): Dicionário com os arrays contendo as informações de
@@ -153,20 +197,19 @@ def dataset_03(sfm, ordem: int):
             forma que qualquer algorítmo de regressão de ML pode utilizar como features.
     """
     size = 60000
-    data = abs_and_phases(sfm)
-    amplitudes = data['amplitudes'].copy()
-    phases = data['phases'].copy()
-    X = np.zeros((size, ordem))
-    for n in range(size):
-        aux = amplitudes[n:ordem+n]
-        X[n] = aux
+    if data is None:
+        data = abs_and_phases(sfm)
+    data = dict(data)
+    amplitudes = data['amplitudes']
+    phases = data['phases']
+    X = _features(amplitudes, size, ordem)
     y = phases[:size]
     data['amplitudes'] = data['amplitudes'][:size]
     data['phases'] = data['phases'][:size]
 
     return data, X, y.reshape(-1,)
 
-def dataset_02_CNN(sfm, ordem: int):
+def dataset_02_CNN(sfm, ordem: int, data=None):
     """O dataset criado pela função é o resultado de uma convolução simples ao longo
     do vetor das amplitudes, para a criação das features, e a fase correspondente à
     primeira amostra de amplitude em cada passo da convolução.
@@ -175,6 +218,8 @@ def dataset_02_CNN(sfm, ordem: int):
         sfm (ResampledQAM: np.ndarray): Símbolos do sinal QAM a ser observado.
         ordem (int): Número de amostras de amplitudes a serem observadas para a análise
             de uma amostra de fase.
+        data (dict, optional): Saída de abs_and_phases(sfm) já calculada, para reaproveitá-la
+            entre os datasets de um mesmo sinal. Não é modificada. Defaults to None.
 
     Returns:
         data (dict[np.ndarray, np.ndarray]): Dicionário com os arrays contendo as informações de
@@ -185,14 +230,12 @@ def dataset_02_CNN(sfm, ordem: int):
             forma que qualquer algorítmo de regressão de ML pode utilizar como features.
     """
     size = 60000
-    data = abs_and_phases(sfm)
-    amplitudes = data['amplitudes'].copy()
-    phases = data['phases'].copy()
-    X = np.zeros((size, ordem, ordem))
-    for n in range(size):
-        aux = amplitudes[n:int(ordem*ordem)+n].reshape(ordem,ordem)
-        X[n] = aux
-    X = X.reshape((size,ordem,ordem,1))
+    if data is None:
+        data = abs_and_phases(sfm)
+    data = dict(data)
+    amplitudes = data['amplitudes']
+    phases = data['phases']
+    X = _features(amplitudes, size, ordem*ordem).reshape((size,ordem,ordem,1))
     y = phases[:size]
     data['amplitudes'] = data['amplitudes'][:size]
     data['phases'] = data['phases'][:size]
@@ -228,17 +271,16 @@ def predict_signal(model,dataset,X_test,size):
     return predicted.reshape((1,-1))
 
 def revert_sfm(sfm, A):
-    sinal_fase_min = sfm.copy()
-    t = np.arange(0, sinal_fase_min[0].size)*1/sinal_fase_min.fs
-    Δf = 2*np.pi*(sinal_fase_min.fb/2)*t
-    sinal_revertido = (sinal_fase_min[0] - A)/np.exp(1j*Δf)
+    phasor = _phasor(sfm[0].size, sfm.fs, sfm.fb)
+    sinal_revertido = np.subtract(sfm[0], A)
+    np.divide(sinal_revertido, phasor, out=sinal_revertido)
     sinal_revertido = sinal_revertido.reshape((1,-1))
     sinal_revertido = normcenter(lowpassFilter(sinal_revertido, sinal_revertido.fs, 1/sinal_revertido.fb, 0.001, taps=4001))
     return sinal_revertido.reshape((1,-1))
 
 def plot_constelation(sinal,SpS):
     ber = sinal[0,::SpS].cal_ber()
-    plt.plot(sinal[0,:5000:SpS].real, sinal[0,:5000:SpS].imag, 'o')
+    plt.hexbin(sinal[0,:5000:SpS].real, sinal[0,:5000:SpS].imag, gridsize=80, mincnt=1)
     plt.xlabel('real')
     plt.ylabel('imaginário')
     plt.title(f'Signal constelation - BER = {ber}')
@@ -247,6 +289,12 @@ def plot_constelation(sinal,SpS):
 
 def plot_spectrum(sinal):
     plt.figure(figsize=(16, 8), dpi=100, facecolor='w', edgecolor='k')
-    plt.magnitude_spectrum(sinal[0,:5000], Fs=sinal.fs, scale='dB', color='C1')
+    x = np.asarray(sinal[0,:5000])
+    window = np.hanning(x.size)
+    mag = np.abs(np.fft.fftshift(np.fft.fft(x*window)))/window.sum()
+    freqs = np.fft.fftshift(np.fft.fftfreq(x.size, 1/sinal.fs))
+    plt.plot(freqs, 20*np.log10(mag), color='C1')
+    plt.xlabel('Frequency')
+    plt.ylabel('Magnitude (dB)')
     plt.grid(True)
     plt.show()
\ No newline at end of file